@@ -1,42 +1,63 @@
+import functools
 import json
 import os
+import threading
 
 import pandas_gbq
 import sqlalchemy
 from flask import Flask, jsonify, make_response, request
-from google.auth.transport import requests
-from google.cloud.alloydb.connector import Connector
-from google.oauth2 import id_token
 
 app = Flask(__name__)
 
+
 ## constants
-with open(
-    os.path.join(os.path.abspath(os.path.dirname(__file__)), "credentials.json")
-) as f:
-    credentials = json.load(f)
-CLIENT_ID = credentials["web"]["client_id"]
-PROJECT_ID = credentials["web"]["project_id"]
+# credentials, the database connection and the libraries only the favourites
+# endpoints use are created on first use, so /forecasts never loads them
+@functools.lru_cache
+def get_credentials():
+    with open(
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), "credentials.json")
+    ) as f:
+        credentials = json.load(f)
+    return credentials["web"]
+
 
 ## database connection
-connector = Connector()
+pool = None
+pool_lock = threading.Lock()
+
+
+def create_pool():
+    from google.cloud.alloydb.connector import Connector
+
+    connector = Connector()
+    project_id = get_credentials()["project_id"]
 
+    def getconn():
+        conn = connector.connect(
+            f"projects/{project_id}/locations/europe-west1/clusters/alloydb-cluster/instances/alloydb-instance",
+            "pg8000",
+            user="alloydb_user",
+            password="alloydb_password",
+            db="postgres",
+        )
+        return conn
 
-def getconn():
-    conn = connector.connect(
-        f"projects/{PROJECT_ID}/locations/europe-west1/clusters/alloydb-cluster/instances/alloydb-instance",
-        "pg8000",
-        user="alloydb_user",
-        password="alloydb_password",
-        db="postgres",
+    return sqlalchemy.create_engine(
+        "postgresql+pg8000://",
+        creator=getconn,
     )
-    return conn
 
 
-pool = sqlalchemy.create_engine(
-    "postgresql+pg8000://",
-    creator=getconn,
-)
+def get_pool():
+    global pool
+    # the server is threaded, so two requests on a cold instance must not both
+    # build a Connector, the second one would leak with its background threads
+    with pool_lock:
+        if pool is None:
+            pool = create_pool()
+    return pool
+
 
 ## database functions
 check_sql = sqlalchemy.text(
@@ -54,7 +75,7 @@ delete_sql = sqlalchemy.text(
 
 
 def add_favourite(user_id, location_id):
-    with pool.connect() as conn:
+    with get_pool().connect() as conn:
         result = conn.execute(
             check_sql.bindparams(user_id=user_id, location_id=location_id)
         ).fetchone()
@@ -66,19 +87,22 @@ def add_favourite(user_id, location_id):
 
 
 def remove_favourite(user_id, location_id):
-    with pool.connect() as conn:
+    with get_pool().connect() as conn:
         conn.execute(delete_sql.bindparams(user_id=user_id, location_id=location_id))
         conn.commit()
 
 
 def list_favourites(user_id):
-    with pool.connect() as conn:
+    with get_pool().connect() as conn:
         favourites = conn.execute(select_sql.bindparams(user_id=user_id)).fetchall()
         return [favourite[0] for favourite in favourites]
 
 
 ## authorization
 def authorize():
+    from google.auth.transport import requests
+    from google.oauth2 import id_token
+
     auth_header = request.headers.get("Authorization")
 
     if auth_header:
@@ -86,7 +110,9 @@ def authorize():
         if bearer.lower() != "bearer":
             return jsonify({"message": "Invalid Authorization header format"}), 400
         try:
-            idinfo = id_token.verify_oauth2_token(token, requests.Request(), CLIENT_ID)
+            idinfo = id_token.verify_oauth2_token(
+                token, requests.Request(), get_credentials()["client_id"]
+            )
             return idinfo["sub"]
         except Exception as e:
             return (
@@ -122,6 +148,7 @@ def get_data():
     WHERE time = '{publication_date} 00:00:00 UTC'
     and latitude in ({min_latitude}, {max_latitude})
     and longitude in ({min_longitude}, {max_longitude})
+    and extract(hour from valid_time) = 12
     order by time, valid_time
     """
 
@@ -1,9 +1,9 @@
+import json
 import os
 
 import google_auth_oauthlib.flow
 import requests
 import streamlit as st
-from googleapiclient.discovery import build
 
 from .config import API_URL, SELF_URL
 
@@ -28,16 +28,32 @@ def _set_favourites():
     st.session_state["favourites"] = r.json()
 
 
-def login():
-    flow = google_auth_oauthlib.flow.Flow.from_client_secrets_file(
-        os.path.join(os.path.abspath(os.path.dirname(__file__)), "credentials.json"),
+@st.cache_resource
+def _get_client_config():
+    with open(
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), "credentials.json")
+    ) as f:
+        return json.load(f)
+
+
+def _get_flow():
+    # only built on reruns that need it, a signed in user never builds one
+    flow = google_auth_oauthlib.flow.Flow.from_client_config(
+        _get_client_config(),
         scopes=["openid", "https://www.googleapis.com/auth/userinfo.email"],
     )
     flow.redirect_uri = SELF_URL
+    return flow
 
+
+def login():
     auth_code = st.query_params.get("code")
     st.query_params.clear()
     if auth_code:
+        # only needed on the OAuth callback, so a cold visitor never imports it
+        from googleapiclient.discovery import build
+
+        flow = _get_flow()
         flow.fetch_token(code=auth_code)
         credentials = flow.credentials
         user_info_service = build(
@@ -56,7 +72,7 @@ def login():
         st.markdown(html_content, unsafe_allow_html=True)
         st.markdown("Signed in as: " + email + " 🎉")
     else:
-        auth_uri, _ = flow.authorization_url()
+        auth_uri, _ = _get_flow().authorization_url()
         content = """<img src="https://lh3.googleusercontent.com/COxitqgJr1sJnIDe8-jiKhxDx1FrYbtRHKJ9z_hELisAlapwE9LUPh6fcXIfb5vwpbMl4xl9H9TRFPc5NOO8Sb3VSgIBrfRYvW6cUA" alt="Google logo" style="margin-right: 8px; width: 20px; height: 20px; background-color: white; border: 2px solid white; border-radius: 4px;">
         Sign in with Google"""
         html_content = SIGN_IN_OUT_BUTTON.format(href=auth_uri, content=content)
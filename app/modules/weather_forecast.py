@@ -2,8 +2,8 @@ import io
 
 import pandas as pd
 import requests
-import seaborn as sns
 import streamlit as st
+from matplotlib.colors import LinearSegmentedColormap
 
 from .config import API_URL
 
@@ -17,6 +17,58 @@ def _download_data(longitude, latitude, publication_date):
     return df
 
 
+# colour stops sampled from the seaborn palettes the table was designed with;
+# importing seaborn, and matplotlib.pyplot with it, slowed every cold start
+t2m_cmap = LinearSegmentedColormap.from_list(
+    "t2m",
+    [
+        "#ecf0ff",
+        "#edf0fc",
+        "#eef0f9",
+        "#eff1f6",
+        "#f0f1f3",
+        "#f2f2f2",
+        "#f3f0f0",
+        "#f6eff0",
+        "#f9eef0",
+        "#fcedf0",
+        "#ffecef",
+    ],
+)
+tp_cmap = LinearSegmentedColormap.from_list(
+    "tp",
+    [
+        "#ffffff",
+        "#f1f6fe",
+        "#dde8fa",
+        "#d1e0f7",
+        "#bfd4f2",
+        "#b4ccee",
+        "#a4c1e7",
+        "#9bb9e2",
+        "#8dafda",
+        "#80a5d2",
+        "#789fcc",
+    ],
+)
+w_cmap = LinearSegmentedColormap.from_list(
+    "w",
+    [
+        "#ffffff",
+        "#fafafa",
+        "#f6f6f6",
+        "#f1f1f1",
+        "#e8e8e8",
+        "#e3e3e3",
+        "#dfdfdf",
+        "#dbdbdb",
+        "#d2d2d2",
+        "#cecece",
+        "#cacaca",
+    ],
+)
+
+
 def get_weather_forecast(latitude, longitude):
     # downloading data
     publication_date = st.session_state.publication_date
@@ -99,30 +151,6 @@ def get_weather_forecast(latitude, longitude):
     gmap = gmap.rename(columns=column_mapper).T
 
     # styling the data
-    t2m_cmap = sns.diverging_palette(
-        h_neg=255, h_pos=0, s=99, l=95, sep=46, as_cmap=True
-    )
-    tp_cmap = sns.cubehelix_palette(
-        start=2.2,
-        rot=0.2,
-        gamma=5,
-        hue=1,
-        light=0.9,
-        dark=1,
-        reverse=True,
-        as_cmap=True,
-    )
-    w_cmap = sns.cubehelix_palette(
-        start=2.3,
-        rot=-1,
-        gamma=4.8,
-        hue=0,
-        light=0.95,
-        dark=1,
-        reverse=True,
-        as_cmap=True,
-    )
-
     df = (
         df.style.background_gradient(
             cmap=t2m_cmap,
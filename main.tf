@@ -224,6 +224,73 @@ EOF
   }
 }
 
+resource "google_bigquery_table" "gefs_daily" {
+  dataset_id          = google_bigquery_dataset.meteo_dataset.dataset_id
+  table_id            = "gefs_daily"
+  description         = "Daily rollups of the 6-hourly GEFS steps. Cycles stored before the 6-hourly schedule have no rows until backfill_gefs.py reprocesses them."
+  deletion_protection = false
+  schema              = <<EOF
+[
+  {
+    "name": "time",
+    "type": "TIMESTAMP",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "valid_date",
+    "type": "DATE",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "latitude",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "longitude",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "number",
+    "type": "INT64",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "t2m_min",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "t2m_max",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "tp_sum",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "w_max",
+    "type": "FLOAT",
+    "mode": "NULLABLE"
+  },
+  {
+    "name": "steps",
+    "type": "INT64",
+    "mode": "NULLABLE",
+    "description": "Number of 6-hourly steps in the day, 4 for a full day. The first and last day of a cycle can be partial."
+  }
+]
+EOF
+
+  time_partitioning {
+    type  = "DAY"
+    field = "time"
+  }
+}
+
 ##############
 # Dataproc
 ##############
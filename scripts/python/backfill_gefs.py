@@ -0,0 +1,264 @@
+import argparse
+import itertools
+import os
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+import pandas_gbq
+
+from update_gefs import (
+    cache_get,
+    cache_max_bytes,
+    delete_cycles,
+    get_forecast_rows,
+    get_links,
+    process_url,
+    rebuild_rollups,
+    url_to_path,
+)
+
+
+def get_cycles(start_date, end_date):
+    return pd.date_range(
+        pd.Timestamp(start_date).ceil("12h"),
+        pd.Timestamp(end_date).floor("12h"),
+        freq="12h",
+    )
+
+
+def get_cycle_links(cycle):
+    return get_links(get_forecast_rows(cycle, cycle))
+
+
+def read_progress(progress_file):
+    if not os.path.exists(progress_file):
+        return set()
+    with open(progress_file) as f:
+        return {pd.Timestamp(line.strip()) for line in f if line.strip()}
+
+
+def write_progress(progress_file, cycle):
+    with open(progress_file, "a") as f:
+        f.write(f"{cycle.isoformat()}\n")
+
+
+def fetch_cycle(
+    cycle,
+    mirror=None,
+    min_interval=0.0,
+    cache=None,
+    max_bytes=cache_max_bytes,
+    download=True,
+):
+    links = get_cycle_links(cycle)
+
+    surface_frames = []
+    last_request = 0.0
+
+    def throttle():
+        nonlocal last_request
+        delay = last_request + min_interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        last_request = time.monotonic()
+
+    for link in links:
+        # cache hits and mirror reads are not throttled, only downloads are
+        surface = process_url(link, mirror, cache, max_bytes, download, throttle)
+        if surface is not None:
+            surface_frames.append(surface)
+
+    # a cycle is only uploaded as a whole, so a rerun can simply replace it
+    if len(surface_frames) < len(links):
+        raise RuntimeError(
+            f"{len(links) - len(surface_frames)} of {len(links)} files failed"
+        )
+
+    return (
+        pd.concat(surface_frames, axis=0)
+        .sort_values(by=["time", "valid_time"])
+        .reset_index(drop=True)
+    )
+
+
+def upload_cycle(cycle, frame_to_upload):
+    # both tables are partitioned by day, so the 00z and 12z cycles of a day
+    # would conflict if they were replaced at the same time; the workers only
+    # download and decode, and the cycles are uploaded here one at a time
+    delete_cycles([cycle])
+    pandas_gbq.to_gbq(
+        frame_to_upload, "meteo_dataset.gefs", if_exists="append", progress_bar=False
+    )
+    rebuild_rollups([cycle])
+
+
+def get_file_size(link, mirror=None, cache=None):
+    if mirror is not None or cache is not None:
+        if mirror is not None:
+            path = url_to_path(link, mirror)
+        else:
+            # an estimate must not change the eviction order
+            path = cache_get(link, cache, verify=False, touch=False)
+        return os.path.getsize(path) if path and os.path.exists(path) else None
+    request = urllib.request.Request(link, method="HEAD")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return int(response.headers["Content-Length"])
+    except OSError as e:
+        print(link, e)
+
+
+def estimate(cycles, mirror, cache, workers, rate_limit, seconds_per_file):
+    links = [link for cycle in cycles for link in get_cycle_links(cycle)]
+    offline = mirror is not None or cache is not None
+
+    if offline:
+        sizes = [get_file_size(link, mirror, cache) for link in links]
+        missing = sum(size is None for size in sizes)
+        total_bytes = sum(size for size in sizes if size is not None)
+        files_per_second = workers / seconds_per_file
+    else:
+        # files of one product have nearly the same size, one request is enough
+        missing = 0
+        size = get_file_size(links[0]) if links else 0
+        total_bytes = size * len(links) if size is not None else None
+        files_per_second = min(rate_limit, workers / seconds_per_file)
+
+    duration = pd.Timedelta(seconds=len(links) / files_per_second)
+
+    print(f"cycles:   {len(cycles)}")
+    print(f"files:    {len(links)}")
+    if offline:
+        print(f"missing:  {missing}")
+    if total_bytes is not None:
+        print(f"size:     {total_bytes / 1024**3:.2f} GiB")
+    else:
+        print("size:     unknown")
+    print(f"duration: {duration.floor('1s')}")
+
+
+def positive(value_type):
+    def parse(value):
+        value = value_type(value)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(f"{value} is not positive")
+        return value
+
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Reprocess GEFS cycles between two dates into BigQuery."
+    )
+    parser.add_argument("start_date", help="first cycle, e.g. 2024-06-01")
+    parser.add_argument("end_date", help="last cycle, e.g. '2024-06-30 12:00'")
+    parser.add_argument(
+        "--workers", type=positive(int), default=4, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=positive(float),
+        default=10.0,
+        help="maximum downloads per second over all workers",
+    )
+    parser.add_argument(
+        "--mirror",
+        help="local directory with the bucket layout, read instead of downloading",
+    )
+    parser.add_argument(
+        "--cache", help="directory of a local GRIB cache, read before downloading"
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=cache_max_bytes / 1024**3,
+        help="size limit of the cache",
+    )
+    parser.add_argument(
+        "--from-cache",
+        action="store_true",
+        help="rebuild the rows from --cache only, without downloading",
+    )
+    parser.add_argument(
+        "--progress-file",
+        default="backfill_gefs.progress",
+        help="completed cycles, skipped when the run is resumed",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only estimate file count, size and duration",
+    )
+    parser.add_argument(
+        "--seconds-per-file",
+        type=positive(float),
+        default=5.0,
+        help="download and decode time of a single file, used by --dry-run",
+    )
+    args = parser.parse_args(argv)
+
+    if args.from_cache and args.cache is None:
+        parser.error("--from-cache requires --cache")
+
+    done = read_progress(args.progress_file)
+    cycles = [
+        cycle
+        for cycle in get_cycles(args.start_date, args.end_date)
+        if cycle not in done
+    ]
+
+    if args.dry_run:
+        estimate(
+            cycles,
+            args.mirror,
+            args.cache if args.from_cache else None,
+            args.workers,
+            args.rate_limit,
+            args.seconds_per_file,
+        )
+        return
+
+    min_interval = args.workers / args.rate_limit
+    max_bytes = int(args.cache_max_gb * 1024**3)
+
+    pending_cycles = iter(cycles)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+
+        def submit_cycles(count):
+            return {
+                executor.submit(
+                    fetch_cycle,
+                    cycle,
+                    args.mirror,
+                    min_interval,
+                    args.cache,
+                    max_bytes,
+                    not args.from_cache,
+                ): cycle
+                for cycle in itertools.islice(pending_cycles, count)
+            }
+
+        # a decoded cycle takes tens of MB, so only a few are in flight and a
+        # finished one is dropped as soon as it is uploaded
+        futures = submit_cycles(2 * args.workers)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                cycle = futures.pop(future)
+                futures.update(submit_cycles(1))
+                try:
+                    upload_cycle(cycle, future.result())
+                    write_progress(args.progress_file, cycle)
+                    print(cycle, "done")
+                except Exception as e:
+                    print(cycle, e)
+            # not kept alive while waiting for the next cycle
+            del finished, future
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# a dummy OAuth client, enough to build a sign-in link without a network call
+CLIENT_CONFIG = {
+    "web": {
+        "client_id": "client-id",
+        "project_id": "project-id",
+        "client_secret": "client-secret",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+}
+
+# forecast rows of the four grid points around the requested location
+FORECAST_CSV = (
+    "time,valid_time,latitude,longitude,number,u10,v10,tp,tcc,t2m,prmsl\n"
+    + "".join(
+        f"2024-06-01 00:00:00,2024-06-0{day} 12:00:00,{latitude},{longitude},-1,"
+        f"1.0,2.0,0.5,40.0,290.0,101300.0\n"
+        for day in range(2, 5)
+        for latitude in (52, 53)
+        for longitude in (21, 22)
+    )
+)
+
+# each snippet runs in a fresh interpreter, prints the time until the server
+# could accept a request and the time of the first response, both in seconds;
+# BigQuery and the API are mocked, so no network is used
+API_SNIPPET = """
+import io
+import json
+import time
+
+start = time.perf_counter()
+
+from unittest import mock
+
+import api
+
+ready = time.perf_counter()
+
+def read_gbq(*args, **kwargs):
+    import pandas as pd
+
+    return pd.read_csv(io.StringIO(FORECAST_CSV))
+
+with mock.patch("pandas_gbq.read_gbq", side_effect=read_gbq):
+    response = api.app.test_client().get(
+        "/forecasts?longitude=21.5&latitude=52.5&publication_date=2024-06-01"
+    )
+assert response.status_code == 200, response.status_code
+
+done = time.perf_counter()
+print(json.dumps({"startup": ready - start, "first_response": done - ready}))
+"""
+
+APP_SNIPPET = """
+import json
+import os
+import time
+
+start = time.perf_counter()
+
+from unittest import mock
+
+from streamlit.testing.v1 import AppTest
+
+ready = time.perf_counter()
+
+with mock.patch("requests.get", return_value=mock.Mock(text=FORECAST_CSV)):
+    app = AppTest.from_file(os.path.abspath("app.py"), default_timeout=120).run()
+assert not app.exception, app.exception
+
+done = time.perf_counter()
+print(json.dumps({"startup": ready - start, "first_response": done - ready}))
+"""
+
+# the container directory, the file with the OAuth client and the snippet
+targets = {
+    "api": ("api", "credentials.json", API_SNIPPET),
+    "app": ("app", os.path.join("modules", "credentials.json"), APP_SNIPPET),
+}
+
+
+def profile(directory, credentials, snippet, repeat):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # a copy, so that the dummy credentials never end up in the repository
+        container_dir = os.path.join(tmp_dir, directory)
+        shutil.copytree(
+            os.path.join(ROOT_DIR, directory),
+            container_dir,
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+        with open(os.path.join(container_dir, credentials), "w") as f:
+            json.dump(CLIENT_CONFIG, f)
+
+        runs = []
+        for _ in range(repeat):
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    f"FORECAST_CSV = {FORECAST_CSV!r}\n{snippet}",
+                ],
+                cwd=container_dir,
+                capture_output=True,
+                text=True,
+            )
+            if result.returncode != 0:
+                raise RuntimeError(result.stderr.strip().splitlines()[-1])
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    # the fastest run has the least noise, as with timeit
+    return min(runs, key=lambda run: run["startup"] + run["first_response"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the time to the first response of the API and "
+        "Streamlit containers."
+    )
+    parser.add_argument("targets", nargs="*", help=f"any of {', '.join(targets)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for target in args.targets:
+        if target not in targets:
+            parser.error(f"unknown target {target}")
+
+    for target in args.targets or targets:
+        run = profile(*targets[target], args.repeat)
+        startup_ms = run["startup"] * 1000
+        first_response_ms = run["first_response"] * 1000
+        print(
+            f"{target}: startup {startup_ms:.0f} ms, "
+            f"first response {first_response_ms:.0f} ms, "
+            f"total {startup_ms + first_response_ms:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
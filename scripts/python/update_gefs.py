@@ -1,11 +1,15 @@
+import argparse
 import datetime as dt
+import hashlib
 import os
 import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import numpy as np
 import pandas as pd
 import pandas_gbq
 import xarray as xr
+from google.cloud import bigquery
 
 longitude = np.concatenate(
     [
@@ -19,60 +23,38 @@ coords = pd.DataFrame(coords).drop_duplicates().to_numpy()
 lon = xr.DataArray(coords[:, 0], dims="idx")
 lat = xr.DataArray(coords[:, 1], dims="idx")
 
+# native 6-hourly GEFS steps; every step carries a 6-hour precipitation bucket,
+# so summing tp over a day does not double count
+forecast_step = pd.Timedelta(hours=6)
+gefs_url = "https://noaa-gefs-pds.s3.amazonaws.com/"
+cache_max_bytes = 50 * 1024**3
+# objects used this recently may be read by another worker right now
+cache_grace_seconds = 5 * 60
 
-def get_links_to_download():
 
-    existing_rows = pandas_gbq.read_gbq(
-        """
-        SELECT DISTINCT time, valid_time, number
-        FROM `meteo_dataset.gefs`
-        WHERE time = ( SELECT MAX(time) FROM `meteo_dataset.gefs` )
-    """,
-        progress_bar_type=None,
-    ).assign(
-        time=lambda x: x.time.dt.tz_localize(None),
-        valid_time=lambda x: x.valid_time.dt.tz_localize(None),
-    )
+def get_valid_time(time):
+    if time.hour == 0:
+        end_time = time + pd.Timedelta(days=15, hours=12)
+    elif time.hour == 12:
+        end_time = time + pd.Timedelta(days=15)
+    return pd.date_range(start=time + forecast_step, end=end_time, freq=forecast_step)
 
-    if existing_rows.empty:
-        start_date = dt.datetime(2024, 5, 26)
-    else:
-        start_date = existing_rows["time"].max()
 
-    end_date = dt.datetime.today()
-    if end_date.hour > 12:
-        end_date = end_date.replace(hour=12, minute=0, second=0, microsecond=0)
-    else:
-        end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-
-    def get_valid_time(time):
-        if time.hour == 0:
-            time = time + pd.Timedelta(hours=12)
-            end_time = time + pd.Timedelta(days=15, hours=12)
-        elif time.hour == 12:
-            end_time = time + pd.Timedelta(days=15)
-        return pd.date_range(start=time, end=end_time, freq="1d")
-
-    correct_df = (
+def get_forecast_rows(start_date, end_date):
+    return (
         pd.DataFrame({"time": pd.date_range(start_date, end_date, freq="12h")})
         .assign(
             valid_time=lambda df: df["time"].apply(get_valid_time),
         )
         .explode("valid_time")
-        .assign(number=lambda x: -1)
-    )
-
-    missing_rows = (
-        pd.merge(
-            left=correct_df,
-            right=existing_rows.assign(right=1),
-            on=["time", "valid_time", "number"],
-            how="left",
+        .assign(
+            valid_time=lambda x: pd.to_datetime(x.valid_time),
+            number=lambda x: -1,
         )
-        .loc[lambda x: x["right"].isna(), ["time", "valid_time", "number"]]
-        .reset_index(drop=True)
     )
 
+
+def get_links(rows):
     def number_to_g(number):
         if number == -1:
             return "geavg"
@@ -81,8 +63,11 @@ def get_links_to_download():
         else:
             return f"gep{number:02d}"
 
+    if rows.empty:
+        return []
+
     links = (
-        missing_rows.assign(
+        rows.assign(
             date=lambda x: x.time.dt.strftime("%Y%m%d"),
             p1="atmos/pgrb2ap5",
             p2="pgrb2a.0p50.",
@@ -94,7 +79,7 @@ def get_links_to_download():
             ),
             f=lambda x: x.f__.map("f{:03}".format),
             link=lambda df: df.apply(
-                lambda x: f"https://noaa-gefs-pds.s3.amazonaws.com/gefs.{x.date}/{x.hour}/{x.p1}/{x.g}.{x.t}.{x.p2}{x.f}",
+                lambda x: f"{gefs_url}gefs.{x.date}/{x.hour}/{x.p1}/{x.g}.{x.t}.{x.p2}{x.f}",
                 axis=1,
             ),
         )
@@ -105,11 +90,188 @@ def get_links_to_download():
     return links
 
 
-def process_url(url):
-    filename = url.split("https://noaa-gefs-pds.s3.amazonaws.com/gefs.")[1].replace(
-        "/", "."
+def get_links_to_download():
+
+    existing_rows = pandas_gbq.read_gbq(
+        """
+        SELECT DISTINCT time, valid_time, number
+        FROM `meteo_dataset.gefs`
+        WHERE time = ( SELECT MAX(time) FROM `meteo_dataset.gefs` )
+    """,
+        progress_bar_type=None,
+    ).assign(
+        time=lambda x: x.time.dt.tz_localize(None),
+        valid_time=lambda x: x.valid_time.dt.tz_localize(None),
     )
+
+    if existing_rows.empty:
+        start_date = dt.datetime(2024, 5, 26)
+    else:
+        start_date = existing_rows["time"].max()
+
+    end_date = dt.datetime.today()
+    if end_date.hour > 12:
+        end_date = end_date.replace(hour=12, minute=0, second=0, microsecond=0)
+    else:
+        end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    correct_df = get_forecast_rows(start_date, end_date)
+
+    missing_rows = (
+        pd.merge(
+            left=correct_df,
+            right=existing_rows.assign(right=1),
+            on=["time", "valid_time", "number"],
+            how="left",
+        )
+        .loc[lambda x: x["right"].isna(), ["time", "valid_time", "number"]]
+        .reset_index(drop=True)
+    )
+
+    return get_links(missing_rows)
+
+
+def url_to_path(url, mirror):
+    # a mirror keeps the bucket layout: <mirror>/gefs.YYYYMMDD/HH/atmos/pgrb2ap5/...
+    return os.path.join(mirror, *url[len(gefs_url) :].split("/"))
+
+
+def file_checksum(filename):
+    checksum = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024**2), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def cache_entry_path(url, cache):
+    return os.path.join(cache, "urls", hashlib.sha256(url.encode()).hexdigest())
+
+
+def cache_get(url, cache, verify=True, touch=True):
+    try:
+        with open(cache_entry_path(url, cache)) as f:
+            object_name = f.readline().strip()
+    except FileNotFoundError:
+        return None
+
+    object_path = os.path.join(cache, "objects", object_name)
     try:
+        if verify and file_checksum(object_path) != object_name.split(".")[0]:
+            os.remove(object_path)
+            return None
+
+        # the modification time is the last use, eviction removes the oldest objects
+        if touch:
+            os.utime(object_path)
+    except FileNotFoundError:
+        # evicted by another worker
+        return None
+    return object_path
+
+
+def cache_put(url, filename, cache, max_bytes=cache_max_bytes):
+    # objects are named by content checksum and keep the file name, which
+    # process_file relies on to recognise f000 files
+    object_name = f"{file_checksum(filename)}.{url.split('/')[-1]}"
+    object_path = os.path.join(cache, "objects", object_name)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    os.replace(filename, object_path)
+
+    entry_path = cache_entry_path(url, cache)
+    os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+    with open(f"{entry_path}.{os.getpid()}", "w") as f:
+        f.write(f"{object_name}\n{url}\n")
+    os.replace(f"{entry_path}.{os.getpid()}", entry_path)
+
+    evict_cache(cache, max_bytes)
+    return object_path
+
+
+def evict_cache(cache, max_bytes):
+    # other workers evict at the same time, so any object may disappear
+    objects = []
+    for entry in os.scandir(os.path.join(cache, "objects")):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((stat.st_mtime, stat.st_size, entry.path))
+    objects.sort()
+
+    total_bytes = sum(size for _, size, _ in objects)
+    recent = dt.datetime.now().timestamp() - cache_grace_seconds
+    evicted = False
+    for mtime, size, path in objects:
+        # the objects are sorted by last use, so the rest are recent as well
+        if total_bytes <= max_bytes or mtime > recent:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        evicted = True
+
+    if evicted:
+        sweep_cache_entries(cache, recent)
+
+
+def sweep_cache_entries(cache, recent):
+    # removes the index entries of evicted objects, so urls/ does not grow
+    # forever; recent entries are skipped, their object may still be written
+    objects_dir = os.path.join(cache, "objects")
+    for entry in os.scandir(os.path.join(cache, "urls")):
+        try:
+            if entry.stat().st_mtime > recent:
+                continue
+            with open(entry.path) as f:
+                object_name = f.readline().strip()
+            if not os.path.exists(os.path.join(objects_dir, object_name)):
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+
+
+def process_url(
+    url,
+    mirror=None,
+    cache=None,
+    max_bytes=cache_max_bytes,
+    download=True,
+    before_download=None,
+):
+    try:
+        if mirror is not None:
+            return process_file(url_to_path(url, mirror))
+
+        filename = cache_get(url, cache) if cache is not None else None
+        if filename is not None:
+            return process_file(filename)
+        if not download:
+            raise FileNotFoundError("not in cache")
+
+        # only called when the file really comes from the network, e.g. to
+        # rate-limit downloads without slowing down cache hits
+        if before_download is not None:
+            before_download()
+
+        filename = url[len(gefs_url) :].replace("/", ".")
+        if cache is not None:
+            # downloaded next to the objects, so moving it into the cache is atomic
+            os.makedirs(os.path.join(cache, "tmp"), exist_ok=True)
+            tmp_filename = os.path.join(cache, "tmp", f"{os.getpid()}.{filename}")
+            try:
+                urllib.request.urlretrieve(url, tmp_filename)
+                # cached before decoding, so a file that fails to decode can be
+                # reprocessed after a fix without downloading it again
+                filename = cache_put(url, tmp_filename, cache, max_bytes)
+            finally:
+                # a failed download is not counted by the size limit of the cache
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+            return process_file(filename)
+
         urllib.request.urlretrieve(url, filename)
         surface = process_file(filename)
         os.remove(filename)
@@ -199,24 +361,131 @@ def process_file(filename):
     return surface
 
 
-def main():
-    links = get_links_to_download()
+def format_times(times):
+    return ", ".join(f"'{time.isoformat(sep=' ')}'" for time in pd.to_datetime(times))
+
+
+def delete_cycles(times):
+    times = format_times(times)
+    bigquery.Client().query(
+        f"DELETE FROM `meteo_dataset.gefs` WHERE time IN ({times})"
+    ).result()
+
+
+def get_stale_cycles():
+    # cycles whose daily rows do not cover every stored step, e.g. when a run
+    # stopped between appending the steps and rebuilding the rollups; cycles
+    # stored before the 6-hourly schedule only hold noon steps, which would be
+    # published as daily min/max and totals, so they are left to backfill_gefs.py
+    stale_cycles = pandas_gbq.read_gbq(
+        """
+        SELECT time
+        FROM (
+            SELECT time, COUNT(*) AS steps
+            FROM `meteo_dataset.gefs`
+            GROUP BY time
+            HAVING COUNTIF(EXTRACT(HOUR FROM valid_time) != 12) > 0
+        )
+        LEFT JOIN (
+            SELECT time, SUM(steps) AS rollup_steps
+            FROM `meteo_dataset.gefs_daily`
+            GROUP BY time
+        )
+        USING (time)
+        WHERE rollup_steps IS NULL OR rollup_steps != steps
+    """,
+        progress_bar_type=None,
+    )
+    return stale_cycles["time"].dt.tz_localize(None).to_list()
 
-    if not len(links):
+
+def rebuild_rollups(times):
+    if not len(times):
         return
 
-    surface_frames = []
+    # a step belongs to the day in which its 6-hour window ends, so a day is made
+    # of the 06, 12, 18 and 24 (00 of the next day) steps; the rows are rebuilt
+    # from the stored steps in one transaction, so they are never half-written
+    times = format_times(times)
+    bigquery.Client().query(f"""
+        BEGIN TRANSACTION;
+
+        DELETE FROM `meteo_dataset.gefs_daily` WHERE time IN ({times});
+
+        INSERT INTO `meteo_dataset.gefs_daily` (
+            time, valid_date, latitude, longitude, number,
+            t2m_min, t2m_max, tp_sum, w_max, steps
+        )
+        SELECT
+            time,
+            DATE(TIMESTAMP_SUB(valid_time, INTERVAL 1 SECOND)) AS valid_date,
+            latitude,
+            longitude,
+            number,
+            MIN(t2m),
+            MAX(t2m),
+            SUM(tp),
+            MAX(SQRT(u10 * u10 + v10 * v10)),
+            COUNT(*)
+        FROM `meteo_dataset.gefs`
+        WHERE time IN ({times})
+        GROUP BY time, valid_date, latitude, longitude, number;
 
-    for link in links:
-        surface = process_url(link)
-        if surface is not None:
-            surface_frames.append(surface)
+        COMMIT TRANSACTION;
+    """).result()
 
-    frame_to_upload = pd.concat(surface_frames, axis=0).reset_index(drop=True)
 
-    pandas_gbq.to_gbq(
-        frame_to_upload, "meteo_dataset.gefs", if_exists="append", progress_bar=False
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Append the missing GEFS steps to BigQuery."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--cache", help="directory of a local GRIB cache, read before downloading"
     )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=cache_max_bytes / 1024**3,
+        help="size limit of the cache",
+    )
+    args = parser.parse_args(argv)
+
+    max_bytes = int(args.cache_max_gb * 1024**3)
+
+    links = get_links_to_download()
+
+    surface_frames = []
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(process_url, link, cache=args.cache, max_bytes=max_bytes)
+            for link in links
+        ]
+        for future in as_completed(futures):
+            surface = future.result()
+            if surface is not None:
+                surface_frames.append(surface)
+
+    if surface_frames:
+        frame_to_upload = (
+            pd.concat(surface_frames, axis=0)
+            .sort_values(by=["time", "valid_time"])
+            .reset_index(drop=True)
+        )
+
+        pandas_gbq.to_gbq(
+            frame_to_upload,
+            "meteo_dataset.gefs",
+            if_exists="append",
+            progress_bar=False,
+        )
+
+    # the cycles appended above are stale too, and so is any cycle left behind
+    # by a run that stopped before its rollups were rebuilt
+    rebuild_rollups(get_stale_cycles())
 
 
 if __name__ == "__main__":